@@ -6,14 +6,34 @@ import os
 import json
 import frida
 import frida_tools
-from itertools import count
+
+
+# Packaged java.js bridge fragment, built on first use.
+_BRIDGE_CACHE = None
+
+
+def _bridge_part() -> str:
+    """Return the packaged java.js bridge fragment, reading it only once."""
+    global _BRIDGE_CACHE
+    if _BRIDGE_CACHE is None:
+        bridge_path = os.path.join(
+            os.path.dirname(frida_tools.__file__), 'bridges', 'java.js'
+        )
+        with open(bridge_path, 'r', encoding='utf-8') as f:
+            bridge_code = f.read()
+
+        bridge_code += "\nObject.defineProperty(globalThis, 'Java', { value: bridge });"
+        size = len(bridge_code.encode('utf-8'))
+        _BRIDGE_CACHE = f'\U0001f4e6\n{size} /frida/repl-1.js\n\u2704\n{bridge_code}'
+    return _BRIDGE_CACHE
 
 
 def build_frida_script(js_code: str) -> str:
     """Build a Frida script with Java bridge for Frida 17.x.
 
     Frida 17.x decoupled the Java bridge from core, so we must manually
-    load java.js and prepend it to the user script.
+    load java.js and prepend it to the user script. The bridge fragment is
+    cached after the first call; only the user wrapper is encoded per call.
 
     Args:
         js_code: JavaScript code to execute in the Frida context.
@@ -21,23 +41,9 @@ def build_frida_script(js_code: str) -> str:
     Returns:
         Packaged script string ready for session.create_script().
     """
-    bridge_path = os.path.join(
-        os.path.dirname(frida_tools.__file__), 'bridges', 'java.js'
-    )
-    with open(bridge_path, 'r', encoding='utf-8') as f:
-        bridge_code = f.read()
-
-    bridge_code += "\nObject.defineProperty(globalThis, 'Java', { value: bridge });"
     wrapper = f'Script.evaluate("u", {json.dumps(js_code)});'
-
-    counter = count(1)
-    parts = []
-    for fragment in [bridge_code, wrapper]:
-        idx = next(counter)
-        size = len(fragment.encode('utf-8'))
-        parts.append(f'{size} /frida/repl-{idx}.js\n\u2704\n{fragment}')
-
-    return '\U0001f4e6\n' + '\n\u2704\n'.join(parts)
+    size = len(wrapper.encode('utf-8'))
+    return f'{_bridge_part()}\n\u2704\n{size} /frida/repl-2.js\n\u2704\n{wrapper}'
 
 
 # Frida JS to enable D6 WebView debugging
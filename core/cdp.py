@@ -4,62 +4,285 @@ Provides async utilities for:
 - Connecting to the D6 WebView devtools socket
 - Executing JavaScript in page context
 - Sending CDP commands
+- Demultiplexing responses and events over one socket (CDPClient)
 """
 import asyncio
-import json
+import contextlib
+import gzip
+import socket
 import subprocess
 import urllib.request
 
 import websockets
 
+from .jsonio import dumps, loads
+
 
 CDP_PORT = 9444
+WS_MAX_SIZE = 50_000_000
+
+# Pre-serialized command envelopes: only the message id and the JSON-encoded
+# variable fields are spliced in, skipping dict construction + full encode.
+# Frames stay str because DevTools expects text frames.
+_COMMAND_TMPL = '{"id":%d,"method":%s,"params":%s}'
+_EVALUATE_TMPL = ('{"id":%d,"method":"Runtime.evaluate","params":'
+                  '{"expression":%s,"returnByValue":%s,"awaitPromise":true}}')
+_NET_ENABLE_TMPL = '{"id":%d,"method":"Network.enable","params":{}}'
+_RESPONSE_BODY_TMPL = ('{"id":%d,"method":"Network.getResponseBody","params":'
+                       '{"requestId":%s}}')
+
+
+@contextlib.asynccontextmanager
+async def connect_ws(ws_url: str):
+    """Open a WebSocket to a CDP target, tuned for small JSON-RPC frames.
 
+    Disables permessage-deflate, keepalive pings and the incoming-frame
+    queue bound (one reader drains it promptly), and sets TCP_NODELAY so
+    small command frames are not held back by Nagle coalescing.
+
+    Args:
+        ws_url: webSocketDebuggerUrl of the target page.
+
+    Yields:
+        The open WebSocket connection.
+    """
+    async with websockets.connect(ws_url, max_size=WS_MAX_SIZE, max_queue=None,
+                                  compression=None, ping_interval=None) as ws:
+        sock = ws.transport.get_extra_info("socket")
+        if sock is not None:
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError:
+                pass
+        yield ws
 
-async def run_js(ws, expr: str, mid: list, timeout: int = 30):
+
+def install_uvloop() -> bool:
+    """Run asyncio on uvloop's faster event loop when it is installed.
+
+    Call before asyncio.run(). Returns True if uvloop was enabled.
+    """
+    try:
+        import uvloop
+    except ImportError:
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+async def run_js(ws, expr: str, mid, timeout: int = 30):
     """Execute JavaScript expression via CDP Runtime.evaluate.
 
     Args:
         ws: WebSocket connection to CDP.
         expr: JavaScript expression to evaluate.
-        mid: Mutable list [int] used as message ID counter.
+        mid: Message ID source shared per connection, e.g. itertools.count(1).
         timeout: Max seconds to wait for response.
 
     Returns:
         The evaluated value, or the full result dict if no 'value' key.
     """
-    mid[0] += 1
-    await ws.send(json.dumps({
-        "id": mid[0],
-        "method": "Runtime.evaluate",
-        "params": {
-            "expression": expr,
-            "returnByValue": True,
-            "awaitPromise": True,
-        }
-    }))
+    msg_id = next(mid)
+    await ws.send(_EVALUATE_TMPL % (msg_id, dumps(expr), "true"))
     while True:
-        resp = json.loads(await asyncio.wait_for(ws.recv(), timeout=timeout))
-        if resp.get("id") == mid[0]:
+        resp = loads(await asyncio.wait_for(ws.recv(), timeout=timeout))
+        if resp.get("id") == msg_id:
             r = resp.get("result", {}).get("result", {})
             return r.get("value", r)
 
 
-async def send_cdp(ws, method: str, params: dict, mid: list):
+async def send_cdp(ws, method: str, params: dict, mid):
     """Send a raw CDP command (fire-and-forget).
 
     Args:
         ws: WebSocket connection.
         method: CDP method name (e.g. "Network.enable").
         params: CDP method parameters.
-        mid: Message ID counter.
+        mid: Message ID source (see run_js).
+    """
+    await ws.send(_COMMAND_TMPL % (next(mid), dumps(method), dumps(params or {})))
+
+
+class CDPClient:
+    """CDP session over one WebSocket with a single background reader.
+
+    Each incoming frame is decoded once and dispatched: command responses
+    resolve the future registered for their `id`, events go to the queue of
+    their `method` (only for methods obtained via `events()`).
+
+    Use as an async context manager around an open WebSocket:
+
+        async with CDPClient(ws) as cdp:
+            title = await cdp.run_js("document.title")
     """
-    mid[0] += 1
-    await ws.send(json.dumps({
-        "id": mid[0],
-        "method": method,
-        "params": params or {},
-    }))
+
+    def __init__(self, ws):
+        self.ws = ws
+        self._next_id = 0
+        self._pending: dict[int, asyncio.Future] = {}
+        self._events: dict[str, asyncio.Queue] = {}
+        self._reader = None
+
+    async def __aenter__(self):
+        self._reader = asyncio.create_task(self._read_loop())
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._reader:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    async def _read_loop(self):
+        try:
+            async for raw in self.ws:
+                msg = loads(raw)
+                msg_id = msg.get("id")
+                if msg_id is not None:
+                    fut = self._pending.pop(msg_id, None)
+                    if fut and not fut.done():
+                        fut.set_result(msg)
+                elif (queue := self._events.get(msg.get("method"))) is not None:
+                    queue.put_nowait(msg)
+            error = ConnectionError("CDP WebSocket closed")
+        except Exception as e:
+            error = e
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(error)
+        self._pending.clear()
+
+    def events(self, method: str) -> asyncio.Queue:
+        """Return the queue receiving events of `method` (e.g. "Network.responseReceived").
+
+        Events are only queued once a queue exists for their method.
+        """
+        if method not in self._events:
+            self._events[method] = asyncio.Queue()
+        return self._events[method]
+
+    async def wait_event(self, method: str, predicate=None, timeout: float = 10):
+        """Wait for a `method` event whose params satisfy `predicate`.
+
+        Call events(method) before triggering the action so the event is
+        queued even if it arrives first. Non-matching events are dropped.
+
+        Returns:
+            The event params, or None on timeout.
+        """
+        queue = self.events(method)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                msg = await asyncio.wait_for(queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return None
+            params = msg.get("params", {})
+            if predicate is None or predicate(params):
+                return params
+
+    def drain(self):
+        """Discard all queued events."""
+        for queue in self._events.values():
+            while not queue.empty():
+                queue.get_nowait()
+
+    async def _send_frame(self, template: str, args: tuple, wait: bool,
+                          timeout: float):
+        """Send `template % (id, *args)` and optionally await its response."""
+        self._next_id += 1
+        msg_id = self._next_id
+        fut = None
+        if wait:
+            fut = asyncio.get_running_loop().create_future()
+            self._pending[msg_id] = fut
+        await self.ws.send(template % ((msg_id,) + args))
+        if fut is None:
+            return None
+        try:
+            return await asyncio.wait_for(fut, timeout=timeout)
+        finally:
+            self._pending.pop(msg_id, None)
+
+    async def send(self, method: str, params: dict = None, wait: bool = True,
+                   timeout: float = 30):
+        """Send a CDP command.
+
+        Args:
+            method: CDP method name.
+            params: CDP method parameters.
+            wait: If False, return immediately without awaiting the response.
+            timeout: Max seconds to wait for the response.
+
+        Returns:
+            The full response message, or None when wait is False.
+        """
+        return await self._send_frame(
+            _COMMAND_TMPL, (dumps(method), dumps(params or {})), wait, timeout)
+
+    async def enable_network(self, wait: bool = True, timeout: float = 30):
+        """Send Network.enable using a pre-serialized envelope."""
+        return await self._send_frame(_NET_ENABLE_TMPL, (), wait, timeout)
+
+    async def get_response_body(self, request_id: str, timeout: float = 30):
+        """Fetch a response body via Network.getResponseBody.
+
+        Returns:
+            The full response message.
+        """
+        return await self._send_frame(
+            _RESPONSE_BODY_TMPL, (dumps(request_id),), True, timeout)
+
+    async def run_js(self, expr: str, timeout: int = 30, by_value: bool = True):
+        """Execute JavaScript expression via CDP Runtime.evaluate.
+
+        Args:
+            expr: JavaScript expression to evaluate.
+            timeout: Max seconds to wait for response.
+            by_value: If False, objects come back as RemoteObject dicts
+                carrying an `objectId` usable with call_function().
+
+        Returns:
+            The evaluated value, or the full result dict if no 'value' key.
+        """
+        resp = await self._send_frame(
+            _EVALUATE_TMPL, (dumps(expr), "true" if by_value else "false"),
+            True, timeout)
+        r = resp.get("result", {}).get("result", {})
+        return r.get("value", r)
+
+    async def call_function(self, object_id: str, declaration: str, *args,
+                            timeout: int = 30):
+        """Call a JS function with `this` bound to a remote object.
+
+        Arguments are passed as CDP values instead of being spliced into
+        the source, so a constant `declaration` is parsed and compiled by
+        V8 once and reused across calls.
+
+        Args:
+            object_id: RemoteObject id to use as `this`.
+            declaration: Function source, e.g. "function(a, b) { ... }".
+            *args: JSON-serializable arguments.
+            timeout: Max seconds to wait for response.
+
+        Returns:
+            The returned value, or the full result dict if no 'value' key.
+        """
+        resp = await self.send("Runtime.callFunctionOn", {
+            "objectId": object_id,
+            "functionDeclaration": declaration,
+            "arguments": [{"value": a} for a in args],
+            "returnByValue": True,
+            "awaitPromise": True,
+        }, timeout=timeout)
+        r = resp.get("result", {}).get("result", {})
+        return r.get("value", r)
 
 
 def setup_port_forward(pid: int, port: int = CDP_PORT):
@@ -85,23 +308,12 @@ def find_invoice_page(port: int = CDP_PORT) -> str | None:
     Returns:
         WebSocket URL string, or None if not found.
     """
-    r = urllib.request.urlopen(f"http://localhost:{port}/json", timeout=5)
-    pages = json.loads(r.read())
-    for p in pages:
-        if 'invoice' in p.get('url', '').lower():
-            return p['webSocketDebuggerUrl']
-    return None
-
-
-async def drain_messages(ws, timeout: float = 0.2):
-    """Drain pending WebSocket messages to clear the buffer.
-
-    Args:
-        ws: WebSocket connection.
-        timeout: How long to wait for each message before stopping.
-    """
-    try:
-        while True:
-            await asyncio.wait_for(ws.recv(), timeout=timeout)
-    except asyncio.TimeoutError:
-        pass
+    req = urllib.request.Request(f"http://localhost:{port}/json",
+                                 headers={"Accept-Encoding": "gzip"})
+    with urllib.request.urlopen(req, timeout=5) as r:
+        raw = r.read()
+        if r.headers.get("Content-Encoding") == "gzip":
+            raw = gzip.decompress(raw)
+    page = next((p for p in loads(raw)
+                 if 'invoice' in p.get('url', '').lower()), None)
+    return page['webSocketDebuggerUrl'] if page else None
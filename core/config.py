@@ -2,6 +2,8 @@
 
 Loads user config from config.json, with defaults for all fields.
 """
+import copy
+import functools
 import json
 import os
 
@@ -21,6 +23,9 @@ DEFAULT_CONFIG = {
         "delay_min": 4,
         "delay_max": 9,
         "retry_limit": 2,
+        "retry_backoff_base": 2,
+        "retry_backoff_cap": 30,
+        "max_consecutive_failures": 5,
         "cdp_port": 9444,
     },
     "paths": {
@@ -33,12 +38,19 @@ DEFAULT_CONFIG = {
     },
 }
 
+# Snapshot of the defaults taken at import, so later mutation of
+# DEFAULT_CONFIG cannot leak into freshly loaded configs.
+_DEFAULTS_FROZEN = copy.deepcopy(DEFAULT_CONFIG)
+
 _config = None
 
 
 def load_config(path: str = "config.json") -> dict:
     """Load config from JSON file, merged with defaults.
 
+    Results are cached per (path, mtime), so repeat calls are cheap and an
+    edited config.json is picked up on the next call.
+
     Args:
         path: Path to config.json.
 
@@ -46,18 +58,9 @@ def load_config(path: str = "config.json") -> dict:
         Merged config dict.
     """
     global _config
-    if _config is not None:
-        return _config
-
-    config = _deep_copy(DEFAULT_CONFIG)
-
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            user_config = json.load(f)
-        _deep_merge(config, user_config)
-
-    _config = config
-    return config
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    _config = _load_config_cached(path, mtime)
+    return _config
 
 
 def get_config() -> dict:
@@ -67,8 +70,20 @@ def get_config() -> dict:
     return _config
 
 
+@functools.lru_cache(maxsize=8)
+def _load_config_cached(path: str, mtime: float | None) -> dict:
+    config = _deep_copy(_DEFAULTS_FROZEN)
+
+    if mtime is not None:
+        with open(path, "r", encoding="utf-8") as f:
+            user_config = json.load(f)
+        _deep_merge(config, user_config)
+
+    return config
+
+
 def _deep_copy(d: dict) -> dict:
-    return json.loads(json.dumps(d))
+    return copy.deepcopy(d)
 
 
 def _deep_merge(base: dict, override: dict):
@@ -7,10 +7,8 @@ Usage:
 import asyncio
 import time
 
-import websockets
-
 from .bridge import attach_and_enable_debug, _default_on_message
-from .cdp import setup_port_forward, find_invoice_page, CDP_PORT
+from .cdp import setup_port_forward, find_invoice_page, connect_ws, CDP_PORT
 
 
 class JDConnection:
@@ -43,7 +41,7 @@ class JDConnection:
             self.close_frida()
             raise RuntimeError("Invoice page not found in CDP targets")
 
-        self._ws_ctx = websockets.connect(ws_url, max_size=50_000_000)
+        self._ws_ctx = connect_ws(ws_url)
         self._ws = await self._ws_ctx.__aenter__()
         return self
 
@@ -0,0 +1,58 @@
+"""JSON encode/decode helpers.
+
+Uses orjson (C extension) when installed, falling back to the stdlib json
+module with equivalent output. CDP frames and the order/plan data files all
+go through these helpers.
+
+Data files are written compact; set JDINV_PRETTY=1 to indent them for
+reading by hand.
+"""
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj) -> str:
+    """Serialize obj to a compact JSON string, keeping non-ASCII as-is."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(data):
+    """Parse JSON from a str or bytes object."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def load_file(path: str):
+    """Read and parse a JSON file."""
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def dump_file(obj, path: str, indent: bool | None = None):
+    """Write obj to a JSON file.
+
+    indent=None (default) indents only when the JDINV_PRETTY environment
+    variable is set; pass True/False to force either layout.
+    """
+    if indent is None:
+        indent = bool(os.environ.get("JDINV_PRETTY"))
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(obj, option=option))
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        if indent:
+            json.dump(obj, f, ensure_ascii=False, indent=2)
+        else:
+            json.dump(obj, f, ensure_ascii=False, separators=(",", ":"))
@@ -0,0 +1,112 @@
+"""Merge progress persistence for resumable batch runs.
+
+Progress lives in a compact JSON snapshot plus an append-only JSONL
+journal beside it (merge_progress.json -> merge_progress.jsonl). Each
+finished invoice is appended to the journal; every few records the
+snapshot is rewritten atomically and the journal truncated, so writes
+stay O(1) per invoice instead of re-serializing the whole history.
+"""
+import os
+
+from .jsonio import dumps, loads, load_file, dump_file
+
+SNAPSHOT_EVERY = 10
+
+
+def journal_path(path: str) -> str:
+    """Return the JSONL journal path for a progress snapshot path."""
+    return os.path.splitext(path)[0] + ".jsonl"
+
+
+def load_progress(path: str) -> dict:
+    """Load the progress snapshot and replay newer journal entries.
+
+    Args:
+        path: Path to the progress snapshot (merge_progress.json).
+
+    Returns:
+        Dict with "completed", "failed" and "skipped" record lists.
+    """
+    progress = {"seq": 0, "completed": [], "failed": [], "skipped": []}
+    if os.path.exists(path):
+        progress.update(load_file(path))
+
+    jpath = journal_path(path)
+    if os.path.exists(jpath):
+        with open(jpath, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = loads(line)
+                except ValueError:
+                    continue  # torn line from an interrupted write
+                if entry["seq"] > progress["seq"]:
+                    progress[entry["status"]].append(entry["record"])
+                    progress["seq"] = entry["seq"]
+    return progress
+
+
+def save_progress(progress: dict, path: str):
+    """Atomically write a compact progress snapshot."""
+    tmp = path + ".tmp"
+    dump_file(progress, tmp, indent=False)
+    os.replace(tmp, path)
+
+
+class ProgressLog:
+    """Progress state backed by a snapshot + JSONL journal.
+
+    `data` is the loaded progress dict. Call add() for each finished
+    invoice and close() at the end of the run.
+    """
+
+    def __init__(self, path: str, snapshot_every: int = SNAPSHOT_EVERY):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.data = load_progress(path)
+        self._journal = None
+        self._unsnapshotted = 0
+
+    def add(self, status: str, record: dict):
+        """Record a finished invoice under `status` ("completed"/"failed")."""
+        self.data[status].append(record)
+        self.data["seq"] += 1
+        if self._journal is None:
+            self._journal = self._open_journal()
+        line = dumps({"seq": self.data["seq"], "status": status, "record": record})
+        self._journal.write(line.encode("utf-8") + b"\n")
+        self._journal.flush()
+
+        self._unsnapshotted += 1
+        if self._unsnapshotted >= self.snapshot_every:
+            self.snapshot()
+
+    def _open_journal(self):
+        """Open the journal for appending, first dropping a torn last line.
+
+        A crash mid-write can leave a partial line without its newline;
+        appending straight after it would corrupt the next record too.
+        """
+        f = open(journal_path(self.path), "a+b")
+        f.seek(0)
+        data = f.read()
+        keep = data.rfind(b"\n") + 1
+        if keep != len(data):
+            f.truncate(keep)
+        return f
+
+    def snapshot(self):
+        """Rewrite the snapshot and truncate the journal."""
+        save_progress(self.data, self.path)
+        if self._journal is not None:
+            self._journal.truncate(0)
+        self._unsnapshotted = 0
+
+    def close(self):
+        """Write a final snapshot if needed and close the journal."""
+        if self._unsnapshotted:
+            self.snapshot()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
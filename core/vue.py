@@ -0,0 +1,83 @@
+"""In-page Vue component index for the invoice center page.
+
+`VUE_INDEX_JS` installs `window.__vueIndex` once per page: one TreeWalker
+pass over document.body, then a MutationObserver that indexes only newly
+added subtrees. Lookups hit the index instead of walking
+`document.querySelectorAll('*')` and probing every element's `__vue__`.
+
+The snippet is a statement block that does nothing when the index already
+exists, so it can be prefixed to any evaluated expression:
+
+    await run_js(ws, VUE_INDEX_JS + "__vueIndex.first('goodsCard') !== null", mid)
+
+Index API (JS), all skipping destroyed instances:
+    __vueIndex.all(name)    instances whose $options.name === name
+    __vueIndex.first(name)  first such instance, or null
+    __vueIndex.find(pred)   first instance of any name with pred(vm) true
+    __orderMap              Map orderId -> order item of mounted goodsCards,
+                            in discovery order (first card per orderId wins)
+"""
+
+VUE_INDEX_JS = r"""
+if (!window.__vueIndex) (function() {
+    var index = window.__vueIndex = {byName: {}, vms: new Set()};
+    var orders = window.__orderMap = new Map();
+
+    function cardItem(vm) {
+        var props = vm.$props || {};
+        var item = vm.item || vm.order || props.item || props.order;
+        if (!item) {
+            for (var pk in props) {
+                if (props[pk] && props[pk].orderId) return props[pk];
+            }
+        }
+        return item;
+    }
+    function addOrder(vm) {
+        var item = cardItem(vm);
+        if (!item || !item.orderId || orders.has(item.orderId)) return;
+        orders.set(item.orderId, item);
+        vm.$once('hook:beforeDestroy', function() {
+            if (orders.get(item.orderId) === item) orders.delete(item.orderId);
+        });
+    }
+    function visit(el) {
+        var vm = el.__vue__;
+        if (!vm || !vm.$options || index.vms.has(vm)) return;
+        index.vms.add(vm);
+        var name = vm.$options.name;
+        if (name) (index.byName[name] = index.byName[name] || new Set()).add(vm);
+        if (name === 'goodsCard') addOrder(vm);
+    }
+    function walk(root) {
+        if (root.nodeType !== 1) return;
+        visit(root);
+        var w = document.createTreeWalker(root, NodeFilter.SHOW_ELEMENT);
+        while (w.nextNode()) visit(w.currentNode);
+    }
+    function live(set) {
+        var out = [];
+        if (set) set.forEach(function(vm) {
+            if (vm._isDestroyed) { set.delete(vm); index.vms.delete(vm); }
+            else out.push(vm);
+        });
+        return out;
+    }
+
+    index.all = function(name) { return live(index.byName[name]); };
+    index.first = function(name) { return index.all(name)[0] || null; };
+    index.find = function(pred) {
+        var vms = live(index.vms);
+        for (var i = 0; i < vms.length; i++) if (pred(vms[i])) return vms[i];
+        return null;
+    };
+
+    walk(document.body);
+    new MutationObserver(function(mutations) {
+        for (var i = 0; i < mutations.length; i++) {
+            var added = mutations[i].addedNodes;
+            for (var j = 0; j < added.length; j++) walk(added[j]);
+        }
+    }).observe(document.body, {childList: true, subtree: true});
+})();
+"""
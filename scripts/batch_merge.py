@@ -2,169 +2,318 @@
 
 Reads merge plan, submits each invoice via CDP + Vue VM manipulation.
 Features: error handling, random delays, retry, progress tracking (resume).
+Progress is journaled per invoice via core.progress.ProgressLog.
 """
 import asyncio
-import json
 import os
+import pickle
 import random
+import re
 import time
 import logging
+import logging.handlers
 from datetime import datetime
 
-import websockets
-
-from core.cdp import run_js, send_cdp, drain_messages
+from core.cdp import CDPClient, connect_ws
 from core.config import get_config
+from core.jsonio import dumps, loads, load_file
+from core.progress import ProgressLog
 from core.connection import JDConnection
 
 
+SEPARATOR = "=" * 50
+
+
 def setup_logging(log_file):
-    """Configure logging to both console and file."""
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s [%(levelname)s] %(message)s",
-        handlers=[
-            logging.StreamHandler(),
-            logging.FileHandler(log_file, encoding="utf-8"),
-        ]
-    )
+    """Configure logging to both console and file.
+
+    File output is buffered through a MemoryHandler and written every 64
+    records, on ERROR, or on flush_logs().
+    """
+    root = logging.getLogger()
+    if not root.handlers:
+        formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+        file_handler = logging.FileHandler(log_file, encoding="utf-8")
+        file_handler.setFormatter(formatter)
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(formatter)
+        root.setLevel(logging.INFO)
+        root.addHandler(stream_handler)
+        root.addHandler(logging.handlers.MemoryHandler(
+            capacity=64, flushLevel=logging.ERROR, target=file_handler))
     return logging.getLogger("batch_merge")
 
 
-def load_progress(path):
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {"completed": [], "failed": [], "skipped": []}
+def flush_logs():
+    """Write out buffered log records."""
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+
+
+# Page markers looked for in location.href
+_URL_RE = re.compile(r'(changeSuccess|ivcTitle|HksAppIvcTitle|orderList|hkList)')
+
+
+def _url_tags(url):
+    """Return the set of page markers present in a location.href value."""
+    if not isinstance(url, str):
+        url = ''
+    return set(_URL_RE.findall(url))
+
+
+# STEP E form fill, called with `this` bound to the form VM. The source is
+# constant so V8 compiles it once; per-invoice data arrives as arguments.
+FILL_FORM_JS = r"""
+function(form, orders) {
+    this.formData.invoiceModelType = 2;
+    this.formData.ivcTitleType = form.ivcTitleType;
+    this.formData.ivcType = form.ivcType;
+    this.formData.ivcContent = form.ivcContent;
+    this.formData.changeReason = form.changeReason;
+    if (this.formData.self) this.formData.self.ivcTitle = form.ivcTitle;
+    try {
+        this.commitBatchHkfpReq(orders);
+        return 'OK';
+    } catch(e) {
+        return 'commit_error: ' + e.message;
+    }
+}"""
+
+
+def build_form_args(ivc_cfg):
+    """Map the `invoice` config section to FILL_FORM_JS form fields."""
+    return {
+        "ivcTitleType": ivc_cfg["ivc_title_type"],
+        "ivcType": ivc_cfg["ivc_type"],
+        "ivcContent": ivc_cfg["ivc_content"],
+        "changeReason": ivc_cfg["change_reason"],
+        "ivcTitle": ivc_cfg["ivc_title"],
+    }
+
+
+def retry_delay(attempt, exec_cfg):
+    """Exponential backoff with jitter before retry number `attempt` (>= 2)."""
+    base = exec_cfg["retry_backoff_base"]
+    cap = exec_cfg["retry_backoff_cap"]
+    return min(cap, base * 2 ** (attempt - 2)) * random.uniform(0.8, 1.2)
+
+
+def load_orders_map(path):
+    """Load all_orders.json as an {orderId: order} dict.
+
+    The dict is cached in a pickle sidecar (all_orders.map.pkl) keyed by
+    the source file's path and mtime, so resumed runs skip the JSON parse.
+    """
+    key = (path, os.path.getmtime(path))
+    cache_path = os.path.splitext(path)[0] + ".map.pkl"
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                cached_key, mapping = pickle.load(f)
+            if cached_key == key:
+                return mapping
+        except Exception:
+            pass
 
+    mapping = {o["orderId"]: o for o in load_file(path)}
+    with open(cache_path, "wb") as f:
+        pickle.dump((key, mapping), f, protocol=pickle.HIGHEST_PROTOCOL)
+    return mapping
 
-def save_progress(progress, path):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(progress, f, ensure_ascii=False, indent=2)
 
+def build_order_payload(invoice, all_orders_map):
+    """Build the orders argument for commitBatchHkfpReq.
 
-async def submit_one_invoice(ws, mid, invoice, all_orders_map, config, log, attempt=1):
-    """Submit a single merged invoice. Returns (success, message)."""
-    org_id = invoice["org_id"]
+    Returns:
+        (orders, None) on success, or (None, error_message).
+    """
     order_ids = invoice["order_ids"]
-    total = invoice["total"]
-    ivc_cfg = config["invoice"]
-
-    # Gather originalOrderInfo for selected orders
-    selected = []
-    for oid in order_ids:
-        order = all_orders_map.get(oid)
-        if not order:
-            return False, f"Order {oid} not found in data"
-        if not order.get("originalOrderInfo"):
-            return False, f"Order {oid} missing originalOrderInfo"
-        selected.append(order)
-
-    inject_json = json.dumps([{
+    missing = next((oid for oid in order_ids if not all_orders_map.get(oid)), None)
+    if missing:
+        return None, f"Order {missing} not found in data"
+
+    orders = [{
         "orderId": o["orderId"],
         "originalOrderInfo": o["originalOrderInfo"],
         "orgId": o.get("orgId"),
         "ivcAmount": o.get("ivcAmount"),
-    } for o in selected], ensure_ascii=False)
+    } for o in map(all_orders_map.__getitem__, order_ids) if o.get("originalOrderInfo")]
+    if len(orders) != len(order_ids):
+        oid = next(oid for oid in order_ids
+                   if not all_orders_map[oid].get("originalOrderInfo"))
+        return None, f"Order {oid} missing originalOrderInfo"
+    return orders, None
+
 
+_PAGE_TEXT_JS = "document.body.innerText.substring(0, 200)"
+
+
+async def _wait_merge_body(cdp, responses, finished, timeout):
+    """Wait for the appDoMergeHkfpReq response and return its parsed body.
+
+    The body is fetched once Network.loadingFinished arrives for the
+    request, since getResponseBody fails while it is still loading.
+
+    Returns:
+        Parsed JSON body (or {"raw": ...}), or None on timeout or when
+        getResponseBody comes back without a body (e.g. the resource was
+        already evicted); None means "no answer", not failure.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    rid = None
+    while (remain := deadline - loop.time()) > 0:
+        try:
+            if rid is None:
+                msg = await asyncio.wait_for(responses.get(), timeout=min(1.0, remain))
+                resp_url = msg["params"]["response"].get("url", "")
+                if "appDoMerge" in resp_url or "DoMerge" in resp_url:
+                    rid = msg["params"]["requestId"]
+                continue
+
+            msg = await asyncio.wait_for(finished.get(), timeout=min(1.0, remain))
+            if msg["params"]["requestId"] != rid:
+                continue
+            resp = await cdp.get_response_body(rid, timeout=max(deadline - loop.time(), 1))
+            if "body" not in resp.get("result", {}):
+                return None
+            body = resp["result"]["body"]
+            try:
+                return loads(body)
+            except Exception:
+                return {"raw": body[:200]}
+        except asyncio.TimeoutError:
+            pass
+    return None
+
+
+async def _wait_merge_page_text(cdp, interval=0.5):
+    """Poll the page until it shows the 已申请 success text. Returns True."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if '已申请' in str(await cdp.run_js(_PAGE_TEXT_JS)):
+                return True
+        except asyncio.TimeoutError:
+            pass
+
+
+async def prepare_invoices(remaining, all_orders_map, queue):
+    """Producer: put (idx, invoice, key, orders, error) per invoice, then None.
+
+    With a maxsize=1 queue this builds the next invoice's payload while the
+    consumer is still awaiting the current one. If building a payload
+    raises, the exception is put on the queue in place of the sentinel so
+    the consumer can re-raise it instead of waiting forever.
+    """
+    try:
+        for idx, (invoice, key) in enumerate(remaining):
+            orders, error = build_order_payload(invoice, all_orders_map)
+            await queue.put((idx, invoice, key, orders, error))
+    except Exception as e:
+        await queue.put(e)
+        return
+    await queue.put(None)
+
+
+async def submit_one_invoice(cdp, orders, form, log, attempt=1):
+    """Submit a single merged invoice. Returns (success, message).
+
+    `cdp` is a CDPClient; its reader task owns the WebSocket, so network
+    events are consumed from its per-method queues rather than ws.recv().
+    The caller must have enabled the Network domain on `cdp` once per
+    session. `orders` comes from build_order_payload() and `form` from
+    build_form_args(); both are built once per invoice, not per attempt.
+    """
     # STEP A: Ensure on order list page
-    url = await run_js(ws, "location.href", mid)
-    if 'changeSuccess' in str(url) or 'ivcTitle' in str(url):
+    url = await cdp.run_js("location.href")
+    tags = _url_tags(url)
+    if 'changeSuccess' in tags or 'ivcTitle' in tags:
         log.info("  Navigating back to order list...")
-        await run_js(ws, "location.href='https://invoice-m.jd.com/#/orderList?sourceId=0'", mid)
+        await cdp.run_js("location.href='https://invoice-m.jd.com/#/orderList?sourceId=0'")
         await asyncio.sleep(3)
-        url = await run_js(ws, "location.href", mid)
+        url = await cdp.run_js("location.href")
+        tags = _url_tags(url)
 
-    if 'orderList' not in str(url) and 'hkList' not in str(url):
-        log.warning(f"  Unexpected URL: {url}, trying direct navigation...")
-        await run_js(ws, "location.href='https://invoice-m.jd.com/#/orderList?sourceId=0'", mid)
+    if 'orderList' not in tags and 'hkList' not in tags:
+        log.warning("  Unexpected URL: %s, trying direct navigation...", url)
+        await cdp.run_js("location.href='https://invoice-m.jd.com/#/orderList?sourceId=0'")
         await asyncio.sleep(3)
 
-    # STEP B: Switch to 换开 tab, check any checkbox, click submit
-    await run_js(ws, """
-        var tab = document.querySelector('.tab-title-item.change');
-        if (tab) tab.click();
-    """, mid)
-    await asyncio.sleep(2)
-
-    await run_js(ws, """
-        var cb = document.querySelector('.order-box-item input[type=checkbox]');
-        if (cb && !cb.checked) cb.click();
-    """, mid)
-    await asyncio.sleep(1)
-
-    await run_js(ws, """
-        var btn = document.querySelector('button.nut-button.primary');
-        if (btn) btn.click();
-    """, mid)
-    await asyncio.sleep(4)
+    # STEP B: Switch to 换开 tab, check any checkbox, click submit (one round-trip)
+    await cdp.run_js(r"""
+        (async function() {
+            function sleep(ms) { return new Promise(function(r) { setTimeout(r, ms); }); }
+            var tab = document.querySelector('.tab-title-item.change');
+            if (tab) tab.click();
+            await sleep(2000);
+            var cb = document.querySelector('.order-box-item input[type=checkbox]');
+            if (cb && !cb.checked) cb.click();
+            await sleep(1000);
+            var btn = document.querySelector('button.nut-button.primary');
+            if (btn) btn.click();
+            await sleep(4000);
+            return 'OK';
+        })()
+    """)
 
     # STEP C: Verify on form page, find Vue VM
-    form_url = await run_js(ws, "location.href", mid)
-    if 'ivcTitle' not in str(form_url) and 'HksAppIvcTitle' not in str(form_url):
+    form_url = await cdp.run_js("location.href")
+    form_tags = _url_tags(form_url)
+    if 'ivcTitle' not in form_tags and 'HksAppIvcTitle' not in form_tags:
         return False, f"Failed to reach form page, URL: {form_url}"
 
-    vm_ok = await run_js(ws, r"""
+    vm_ref = await cdp.run_js(r"""
         (function() {
-            var els = document.querySelectorAll('*');
-            for (var i = 0; i < els.length; i++) {
-                var vm = els[i].__vue__;
-                if (vm && vm.$options && vm.$options.methods &&
-                    vm.$options.methods.commitBatchHkfpReq) {
-                    window.__vm = vm;
-                    return true;
+            function isFormVM(vm) {
+                return vm && !vm._isDestroyed && vm.$options && vm.$options.methods &&
+                    vm.$options.methods.commitBatchHkfpReq;
+            }
+            if (isFormVM(window.__vm)) return window.__vm;
+            // Likely form containers first; full DOM scan only as a fallback
+            var selectors = ['.ivc-form', '[class*="hks"]', '#app > *', '*'];
+            for (var s = 0; s < selectors.length; s++) {
+                var els = document.querySelectorAll(selectors[s]);
+                for (var i = 0; i < els.length; i++) {
+                    var vm = els[i].__vue__;
+                    if (isFormVM(vm)) {
+                        window.__vm = vm;
+                        return vm;
+                    }
                 }
             }
-            return false;
+            return null;
         })()
-    """, mid)
-    if not vm_ok:
+    """, by_value=False)
+    if not vm_ref or "objectId" not in vm_ref:
         return False, "Vue VM not found on form page"
 
-    # STEP D: Enable Network monitoring
-    await send_cdp(ws, "Network.enable", {}, mid)
-    await asyncio.sleep(0.3)
-    await drain_messages(ws)
+    # STEP D: Subscribe to Network events (enabled once by the caller) and
+    # drop stale ones from earlier invoices
+    responses = cdp.events("Network.responseReceived")
+    finished = cdp.events("Network.loadingFinished")
+    cdp.drain()
 
     # STEP E: Set form + inject orders + call commit
-    ivc_title = ivc_cfg["ivc_title"]
-    result = await run_js(ws, f"""
-        (function() {{
-            var vm = window.__vm;
-            if (!vm) return 'no_vm';
-            vm.formData.invoiceModelType = 2;
-            vm.formData.ivcTitleType = {ivc_cfg['ivc_title_type']};
-            vm.formData.ivcType = {ivc_cfg['ivc_type']};
-            vm.formData.ivcContent = {ivc_cfg['ivc_content']};
-            vm.formData.changeReason = '{ivc_cfg['change_reason']}';
-            if (vm.formData.self) vm.formData.self.ivcTitle = '{ivc_title}';
-            var orders = {inject_json};
-            try {{
-                vm.commitBatchHkfpReq(orders);
-                return 'OK';
-            }} catch(e) {{
-                return 'commit_error: ' + e.message;
-            }}
-        }})()
-    """, mid)
+    result = await cdp.call_function(vm_ref["objectId"], FILL_FORM_JS, form, orders)
+    await cdp.send("Runtime.releaseObject", {"objectId": vm_ref["objectId"]}, wait=False)
 
     if result != 'OK':
         return False, f"commitBatchHkfpReq failed: {result}"
 
     # STEP F: Wait for checkMergeHkfpReq server response
+    loop = asyncio.get_running_loop()
     check_ok = False
-    deadline = time.time() + 10
-    while time.time() < deadline:
+    deadline = loop.time() + 10
+    while (remain := deadline - loop.time()) > 0:
         try:
-            raw = await asyncio.wait_for(ws.recv(), timeout=1)
-            msg = json.loads(raw)
-            if msg.get("method") == "Network.responseReceived":
-                resp_url = msg["params"]["response"].get("url", "")
-                if "checkMerge" in resp_url:
-                    status = msg["params"]["response"].get("status")
-                    log.info(f"  checkMergeHkfpReq: HTTP {status}")
-                    check_ok = (status == 200)
-                    break
+            msg = await asyncio.wait_for(responses.get(), timeout=min(1.0, remain))
+            resp_url = msg["params"]["response"].get("url", "")
+            if "checkMerge" in resp_url:
+                status = msg["params"]["response"].get("status")
+                log.info("  checkMergeHkfpReq: HTTP %s", status)
+                check_ok = (status == 200)
+                break
         except asyncio.TimeoutError:
             pass
 
@@ -175,7 +324,7 @@ async def submit_one_invoice(ws, mid, invoice, all_orders_map, config, log, atte
     confirm = 'not_ready'
     for wait_i in range(10):
         await asyncio.sleep(1.5)
-        confirm = await run_js(ws, r"""
+        confirm = await cdp.run_js(r"""
             (function() {
                 var vm = window.__vm;
                 if (!vm) return 'no_vm';
@@ -185,46 +334,38 @@ async def submit_one_invoice(ws, mid, invoice, all_orders_map, config, log, atte
                 }
                 return 'waiting_groupList';
             })()
-        """, mid)
+        """)
         if confirm == 'submitMerge_ok':
-            log.info(f"  submitMerge() called (after {(wait_i+1)*1.5:.1f}s)")
+            log.info("  submitMerge() called (after %.1fs)", (wait_i + 1) * 1.5)
             break
 
     if confirm != 'submitMerge_ok':
         return False, f"submitMerge failed: {confirm}"
 
-    # STEP H: Wait for appDoMergeHkfpReq response
-    merge_result = None
-    deadline = time.time() + 15
-    while time.time() < deadline:
-        try:
-            raw = await asyncio.wait_for(ws.recv(), timeout=1)
-            msg = json.loads(raw)
-            method = msg.get("method", "")
-
-            if method == "Network.responseReceived":
-                resp_url = msg["params"]["response"].get("url", "")
-                if "appDoMerge" in resp_url or "DoMerge" in resp_url:
-                    rid = msg["params"]["requestId"]
-                    mid[0] += 1
-                    await ws.send(json.dumps({
-                        "id": mid[0],
-                        "method": "Network.getResponseBody",
-                        "params": {"requestId": rid}
-                    }))
-
-            elif msg.get("id") and "body" in msg.get("result", {}):
-                body = msg["result"]["body"]
-                try:
-                    merge_result = json.loads(body)
-                except Exception:
-                    merge_result = {"raw": body[:200]}
-                break
-        except asyncio.TimeoutError:
-            pass
-
+    # STEP H: Wait for appDoMergeHkfpReq response body or the page's own
+    # success text, whichever comes first
+    deadline = loop.time() + 15
+    body_task = asyncio.create_task(
+        _wait_merge_body(cdp, responses, finished, timeout=15))
+    text_task = asyncio.create_task(_wait_merge_page_text(cdp))
+    done, pending = await asyncio.wait(
+        {body_task, text_task}, timeout=15, return_when=asyncio.FIRST_COMPLETED)
+    if body_task in done and body_task.result() is None and text_task in pending:
+        # No usable body (e.g. getResponseBody error): keep watching the page
+        # text for the rest of the window instead of giving up early
+        more, _ = await asyncio.wait({text_task}, timeout=max(deadline - loop.time(), 0))
+        done |= more
+        pending -= more
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+    if text_task in done and text_task.result():
+        return True, "Success (detected from page text)"
+
+    merge_result = body_task.result() if body_task in done else None
     if not merge_result:
-        page_text = await run_js(ws, "document.body.innerText.substring(0, 200)", mid)
+        page_text = await cdp.run_js(_PAGE_TEXT_JS)
         if '已申请' in str(page_text):
             return True, "Success (detected from page text)"
         return False, "appDoMergeHkfpReq timeout"
@@ -232,7 +373,7 @@ async def submit_one_invoice(ws, mid, invoice, all_orders_map, config, log, atte
     if merge_result.get("code") == 0 and merge_result.get("data", {}).get("allSuccess"):
         return True, "allSuccess=true"
     else:
-        return False, f"Server rejected: {json.dumps(merge_result, ensure_ascii=False)[:200]}"
+        return False, f"Server rejected: {dumps(merge_result)[:200]}"
 
 
 async def batch_merge(ws_url):
@@ -240,94 +381,119 @@ async def batch_merge(ws_url):
     config = get_config()
     paths = config["paths"]
     exec_cfg = config["execution"]
+    form = build_form_args(config["invoice"])
 
     log = setup_logging(paths["log_file"])
-    mid = [0]
 
-    with open(paths["merge_plan_file"], "r", encoding="utf-8") as f:
-        plan = json.load(f)
-    with open(paths["all_orders_file"], "r", encoding="utf-8") as f:
-        all_orders = json.load(f)
-    all_orders_map = {o["orderId"]: o for o in all_orders}
+    plan = load_file(paths["merge_plan_file"])
+    all_orders_map = load_orders_map(paths["all_orders_file"])
 
     invoices = plan["invoices"]
-    progress = load_progress(paths["merge_progress_file"])
-    completed_set = set(
-        tuple(sorted(inv["order_ids"])) for inv in progress["completed"]
-    )
+    progress_log = ProgressLog(paths["merge_progress_file"])
+    progress = progress_log.data
+    completed_keys = {frozenset(inv["order_ids"]) for inv in progress["completed"]}
 
     initial_completed = len(progress["completed"])
     log.info(f"Plan: {len(invoices)} invoices")
     log.info(f"Already completed: {initial_completed}")
-    remaining = [inv for inv in invoices
-                 if tuple(sorted(inv["order_ids"])) not in completed_set]
+    plan_keys = [frozenset(inv["order_ids"]) for inv in invoices]
+    remaining = [(inv, key) for inv, key in zip(invoices, plan_keys)
+                 if key not in completed_keys]
     log.info(f"Remaining: {len(remaining)} invoices")
 
     if not remaining:
         log.info("All invoices already completed!")
         return
 
-    async with websockets.connect(ws_url, max_size=50_000_000) as ws:
-        for idx, invoice in enumerate(remaining):
-            inv_num = idx + 1 + initial_completed
-            total_num = len(invoices)
-            org_id = invoice["org_id"]
-            total = invoice["total"]
-            n_orders = len(invoice["order_ids"])
-
-            log.info(f"\n{'='*50}")
-            log.info(f"Invoice {inv_num}/{total_num}: orgId={org_id}, "
-                     f"{n_orders} orders, ¥{total:.2f}")
-            log.info(f"{'='*50}")
-
-            success = False
-            message = ""
-
-            for attempt in range(1, exec_cfg["retry_limit"] + 1):
-                if attempt > 1:
-                    delay = random.uniform(3, 6)
-                    log.info(f"  Retry {attempt}/{exec_cfg['retry_limit']} after {delay:.1f}s...")
-                    await asyncio.sleep(delay)
+    max_failures = exec_cfg["max_consecutive_failures"]
+    consecutive_failures = 0
 
-                try:
-                    success, message = await submit_one_invoice(
-                        ws, mid, invoice, all_orders_map, config, log, attempt)
-                except Exception as e:
-                    message = f"Exception: {e}"
-                    log.error(f"  {message}")
-                    success = False
+    async with connect_ws(ws_url) as ws, CDPClient(ws) as cdp:
+        await cdp.enable_network()
+        # Payloads are prepared one invoice ahead by a producer task, so
+        # that work overlaps the current invoice's CDP waits
+        prepared = asyncio.Queue(maxsize=1)
+        producer = asyncio.create_task(
+            prepare_invoices(remaining, all_orders_map, prepared))
+        try:
+            while (item := await prepared.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                idx, invoice, key, orders, error = item
+                inv_num = idx + 1 + initial_completed
+                total_num = len(invoices)
+                org_id = invoice["org_id"]
+                total = invoice["total"]
+                n_orders = len(invoice["order_ids"])
+
+                log.info("\n%s", SEPARATOR)
+                log.info("Invoice %d/%d: orgId=%s, %d orders, ¥%.2f",
+                         inv_num, total_num, org_id, n_orders, total)
+                log.info(SEPARATOR)
+
+                success = False
+                message = error or ""
+                # Missing order data won't fix itself on retry
+                attempts = exec_cfg["retry_limit"] if orders is not None else 0
+
+                for attempt in range(1, attempts + 1):
+                    if attempt > 1:
+                        delay = retry_delay(attempt, exec_cfg)
+                        log.info("  Retry %d/%d after %.1fs...", attempt, exec_cfg["retry_limit"], delay)
+                        await asyncio.sleep(delay)
+
+                    try:
+                        success, message = await submit_one_invoice(
+                            cdp, orders, form, log, attempt)
+                    except Exception as e:
+                        message = f"Exception: {e}"
+                        log.error("  %s", message)
+                        success = False
+
+                    if success:
+                        break
+
+                record = {
+                    "org_id": org_id,
+                    "order_ids": invoice["order_ids"],
+                    "total": total,
+                    "time": datetime.now().isoformat(),
+                    "message": message,
+                }
 
                 if success:
+                    log.info("  SUCCESS: %s", message)
+                    progress_log.add("completed", record)
+                    completed_keys.add(key)
+                    consecutive_failures = 0
+                else:
+                    log.error("  FAILED: %s", message)
+                    progress_log.add("failed", record)
+                    if attempts:
+                        consecutive_failures += 1
+                flush_logs()
+
+                if max_failures and consecutive_failures >= max_failures:
+                    log.error("  %d consecutive failures, aborting batch", consecutive_failures)
                     break
 
-            record = {
-                "org_id": org_id,
-                "order_ids": invoice["order_ids"],
-                "total": total,
-                "time": datetime.now().isoformat(),
-                "message": message,
-            }
-
-            if success:
-                log.info(f"  SUCCESS: {message}")
-                progress["completed"].append(record)
-            else:
-                log.error(f"  FAILED: {message}")
-                progress["failed"].append(record)
-
-            save_progress(progress, paths["merge_progress_file"])
-
-            if idx < len(remaining) - 1:
-                delay = random.uniform(exec_cfg["delay_min"], exec_cfg["delay_max"])
-                log.info(f"  Waiting {delay:.1f}s before next...")
-                await asyncio.sleep(delay)
+                # A fast failure (bad order data) never reached the server
+                if idx < len(remaining) - 1 and attempts:
+                    delay = random.uniform(exec_cfg["delay_min"], exec_cfg["delay_max"])
+                    log.info("  Waiting %.1fs before next...", delay)
+                    await asyncio.sleep(delay)
+        finally:
+            producer.cancel()
+            # Compact the journal into the snapshot even on abort/crash
+            progress_log.close()
 
-    log.info(f"\n{'='*50}")
-    log.info(f"BATCH COMPLETE")
+    log.info("\n%s", SEPARATOR)
+    log.info("BATCH COMPLETE")
     log.info(f"  Completed: {len(progress['completed'])}")
     log.info(f"  Failed:    {len(progress['failed'])}")
     log.info(f"  Total amount: ¥{sum(inv['total'] for inv in progress['completed']):.2f}")
-    log.info(f"{'='*50}")
+    log.info(SEPARATOR)
+    flush_logs()
 
 
 def main():
@@ -336,7 +502,7 @@ def main():
     os.makedirs(config["paths"]["data_dir"], exist_ok=True)
 
     from core.bridge import attach_and_enable_debug
-    from core.cdp import setup_port_forward, find_invoice_page
+    from core.cdp import setup_port_forward, find_invoice_page, install_uvloop
     import time
 
     log = setup_logging(config["paths"]["log_file"])
@@ -353,6 +519,7 @@ def main():
             log.error("Invoice page not found in CDP!")
             return
         log.info(f"CDP connected: {ws_url[:80]}")
+        install_uvloop()
         asyncio.run(batch_merge(ws_url))
     except Exception as e:
         log.error(f"Error: {e}")
@@ -5,18 +5,82 @@ uses goodsCard.jumpToHk() to navigate to individual 换开 form page.
 Primarily targets orders >= target amount that don't need merging.
 """
 import asyncio
-import json
+import itertools
 import os
 import random
 import subprocess
 import time
 
-import websockets
-
-from core.cdp import run_js, send_cdp, drain_messages
+from core.cdp import run_js, send_cdp, connect_ws
 from core.config import get_config
+from core.jsonio import dumps, loads, load_file
+from core.vue import VUE_INDEX_JS
 from core.connection import JDConnection
 
+# Per-order page helpers, installed once per page (see find_goods_card) so
+# each order only evaluates a short call instead of re-sending the source.
+#   __hkJump(order): jumpToHk, wait for the form page, locate the form VM
+#   __hkSubmit(form, method): fill the form, submit, poll for the result
+HK_FUNCS_JS = r"""
+if (!window.__hkJump) (function() {
+    function sleep(ms) { return new Promise(function(r) { setTimeout(r, ms); }); }
+    function onForm() { return location.href.indexOf('HkAppIvcTitle') >= 0; }
+
+    window.__hkJump = async function(order) {
+        var card = window.__anyCard;
+        if (!card) return JSON.stringify({step: 'jump', error: 'no_card'});
+        try {
+            card.jumpToHk(order);
+        } catch(e) {
+            return JSON.stringify({step: 'jump', error: 'error: ' + e.message});
+        }
+        for (var i = 0; i < 16 && !onForm(); i++) await sleep(500);
+        if (!onForm()) {
+            return JSON.stringify({step: 'form', url: location.href,
+                body: document.body.innerText.substring(0, 200)});
+        }
+        for (var t = 0; t < 8; t++) {
+            var vm = window.__vueIndex.find(function(vm) {
+                var m = vm.$options.methods;
+                return m && (m.commitHkfpReq || m.commitBatchHkfpReq || m.submitHkfp);
+            });
+            if (vm) {
+                window.__formVM = vm;
+                return JSON.stringify({
+                    step: 'ok', url: location.href,
+                    methods: Object.keys(vm.$options.methods).filter(function(m) {
+                        return m.indexOf('commit') >= 0 || m.indexOf('submit') >= 0;
+                    })
+                });
+            }
+            await sleep(500);
+        }
+        return JSON.stringify({step: 'vm', url: location.href});
+    };
+
+    window.__hkSubmit = async function(form, method) {
+        var vm = window.__formVM;
+        vm.formData.ivcTitleType = form.ivcTitleType;
+        vm.formData.ivcType = form.ivcType;
+        vm.formData.ivcContent = form.ivcContent;
+        vm.formData.changeReason = form.changeReason;
+        if (vm.formData.self) vm.formData.self.ivcTitle = form.ivcTitle;
+        try {
+            vm[method]();
+        } catch(e) {
+            return JSON.stringify({submitted: false, error: 'error: ' + e.message});
+        }
+        var text = '';
+        for (var i = 0; i < 10; i++) {
+            await sleep(500);
+            text = document.body.innerText.substring(0, 300);
+            if (text.indexOf('已申请') >= 0 || text.indexOf('成功') >= 0) break;
+        }
+        return JSON.stringify({submitted: true, text: text});
+    };
+})();
+"""
+
 
 async def find_goods_card(ws, mid, max_attempts=10):
     """Wait for a goodsCard Vue instance to appear in DOM.
@@ -25,28 +89,25 @@ async def find_goods_card(ws, mid, max_attempts=10):
         True if found (stored as window.__anyCard), False otherwise.
     """
     for attempt in range(max_attempts):
-        await asyncio.sleep(2)
-        subprocess.run(
-            ["adb", "shell", "input", "swipe", "540", "1800", "540", "600", "300"],
-            capture_output=True
-        )
-        await asyncio.sleep(1)
-        found = await run_js(ws, r"""
-            (function() {
-                var els = document.querySelectorAll('*');
-                for (var i = 0; i < els.length; i++) {
-                    var vm = els[i].__vue__;
-                    if (vm && vm.$options.name === 'goodsCard') {
-                        window.__anyCard = vm;
-                        return true;
-                    }
+        # Poll the index in-page for up to 2s; returns as soon as a card renders
+        found = await run_js(ws, VUE_INDEX_JS + HK_FUNCS_JS + r"""
+            (async function() {
+                for (var i = 0; i < 20; i++) {
+                    var card = window.__vueIndex.first('goodsCard');
+                    if (card) { window.__anyCard = card; return true; }
+                    await new Promise(function(r) { setTimeout(r, 100); });
                 }
                 return false;
             })()
-        """, mid)
+        """, mid, timeout=10)
         if found:
             print(f"  Found goodsCard after {attempt+1} attempts")
             return True
+        subprocess.run(
+            ["adb", "shell", "input", "swipe", "540", "1800", "540", "600", "300"],
+            capture_output=True
+        )
+        await asyncio.sleep(1)
     return False
 
 
@@ -55,15 +116,23 @@ async def navigate_to_all_tab(ws, mid):
     url = await run_js(ws, "location.href", mid)
     if 'orderList' not in str(url):
         await run_js(ws, "location.href='https://invoice-m.jd.com/#/orderList?sourceId=0'", mid)
-        await asyncio.sleep(3)
 
+    # The hash route changes before the view renders: poll in-page for the
+    # 全部 tab (up to 3s) and click it as soon as it exists
     await run_js(ws, r"""
-        var tabs = document.querySelectorAll('.tab-title-item');
-        for (var i = 0; i < tabs.length; i++) {
-            if (tabs[i].textContent.trim() === '全部') { tabs[i].click(); break; }
-        }
-    """, mid)
+        (async function() {
+            for (var t = 0; t < 30; t++) {
+                var tabs = document.querySelectorAll('.tab-title-item');
+                for (var i = 0; i < tabs.length; i++) {
+                    if (tabs[i].textContent.trim() === '全部') { tabs[i].click(); return true; }
+                }
+                await new Promise(function(r) { setTimeout(r, 100); });
+            }
+            return false;
+        })()
+    """, mid, timeout=10)
     await asyncio.sleep(2)
+    await run_js(ws, VUE_INDEX_JS, mid)
 
 
 async def work(ws_url):
@@ -71,34 +140,35 @@ async def work(ws_url):
     config = get_config()
     ivc_cfg = config["invoice"]
     paths = config["paths"]
-    mid = [0]
-
-    async with websockets.connect(ws_url, max_size=50_000_000) as ws:
+    mid = itertools.count(1)
 
+    async with connect_ws(ws_url) as ws:
         # 1. Navigate to 全部 tab
         await navigate_to_all_tab(ws, mid)
 
         # 2. Load target orders from saved data
         print("--- Loading target orders ---")
-        with open(paths["all_tab_orders_file"], "r", encoding="utf-8") as f:
-            all_tab = json.load(f)
-        with open(paths["all_orders_file"], "r", encoding="utf-8") as f:
-            hk_orders = json.load(f)
+        all_tab = load_file(paths["all_tab_orders_file"])
+        hk_orders = load_file(paths["all_orders_file"])
 
-        hk_ids = set(o["orderId"] for o in hk_orders)
+        hk_ids = frozenset(o["orderId"] for o in hk_orders)
         target_amount = config["merge"]["target_amount"]
 
+        # Parse the invoice amount once per order
+        for o in all_tab:
+            o["_amt"] = float(o.get("actualInvoiceAmount") or o.get("ivcAmount") or 0)
+
         targets = [o for o in all_tab
-                   if o["orderId"] not in hk_ids
-                   and o.get("canHk")
-                   and str(o.get("ivcStatus")) == "1"
-                   and float(o.get("actualInvoiceAmount") or o.get("ivcAmount") or 0) >= target_amount]
-        targets.sort(key=lambda o: -float(o.get("actualInvoiceAmount") or o.get("ivcAmount") or 0))
+                   if o.get("canHk")
+                   and o.get("ivcStatus") in (1, "1")
+                   and o["orderId"] not in hk_ids
+                   and o["_amt"] >= target_amount]
+        targets.sort(key=lambda o: -o["_amt"])
 
         print(f"  {len(targets)} orders >= ¥{target_amount} to 换开:")
         total_amt = 0
         for o in targets:
-            amt = float(o.get("actualInvoiceAmount") or o.get("ivcAmount") or 0)
+            amt = o["_amt"]
             total_amt += amt
             prod = o["products"][0]["name"][:35] if o.get("products") else ""
             print(f"    {o['orderId']} ¥{amt:.2f} | {o.get('ivcTitle','')} | {prod}")
@@ -116,12 +186,19 @@ async def work(ws_url):
 
         # 4. Process each order
         print(f"\n--- Processing {len(targets)} orders ---")
+        form_json = dumps({
+            "ivcTitleType": ivc_cfg["ivc_title_type"],
+            "ivcType": ivc_cfg["ivc_type"],
+            "ivcContent": ivc_cfg["ivc_content"],
+            "changeReason": ivc_cfg["change_reason"],
+            "ivcTitle": ivc_cfg["ivc_title"],
+        })
         success_count = 0
         fail_count = 0
 
         for idx, order in enumerate(targets):
             oid = order["orderId"]
-            amt = float(order.get("actualInvoiceAmount") or order.get("ivcAmount") or 0)
+            amt = order["_amt"]
             print(f"\n{'='*50}")
             print(f"Order {idx+1}/{len(targets)}: {oid} ¥{amt:.2f}")
             print(f"{'='*50}")
@@ -135,80 +212,40 @@ async def work(ws_url):
                     fail_count += 1
                     continue
 
-            # Step A: Call jumpToHk
-            order_json = json.dumps({
+            # Steps A-C in one round-trip: jumpToHk, wait for the form
+            # page, then locate the form VM (all polled in-page)
+            order_json = dumps({
                 "orderId": order["orderId"],
                 "ivcType": order.get("ivcType", "23"),
                 "ivcTitle": order.get("ivcTitle", ""),
                 "passKey": order.get("passKey", ""),
                 "tagStr": order.get("tagStr", ""),
-            }, ensure_ascii=False)
-
-            result = await run_js(ws, f"""
-                (async function() {{
-                    var card = window.__anyCard;
-                    if (!card) return 'no_card';
-                    var orderData = {order_json};
-                    try {{
-                        card.jumpToHk(orderData);
-                        return 'called';
-                    }} catch(e) {{
-                        return 'error: ' + e.message;
-                    }}
-                }})()
-            """, mid)
-            print(f"  jumpToHk: {result}")
-
-            if result != 'called':
-                print(f"  FAILED: {result}")
+            })
+
+            jump_raw = await run_js(ws, f"__hkJump({order_json})", mid, timeout=15)
+
+            jump = loads(jump_raw) if isinstance(jump_raw, str) else {"step": "jump", "error": jump_raw}
+            if jump["step"] == "jump":
+                print(f"  FAILED: jumpToHk {jump.get('error')}")
                 fail_count += 1
                 continue
+            print(f"  Form URL: {str(jump.get('url'))[:100]}")
 
-            # Step B: Wait for form page
-            await asyncio.sleep(4)
-            form_url = await run_js(ws, "location.href", mid)
-            print(f"  Form URL: {str(form_url)[:100]}")
-
-            if 'HkAppIvcTitle' not in str(form_url):
-                toast = await run_js(ws, "document.body.innerText.substring(0, 200)", mid)
-                print(f"  NOT on form page. Body: {toast}")
+            if jump["step"] == "form":
+                print(f"  NOT on form page. Body: {jump.get('body')}")
                 fail_count += 1
                 await asyncio.sleep(2)
                 continue
 
-            # Step C: Find Vue VM on form page
-            await asyncio.sleep(2)
-            vm_found = await run_js(ws, r"""
-                (function() {
-                    var els = document.querySelectorAll('*');
-                    for (var i = 0; i < els.length; i++) {
-                        var vm = els[i].__vue__;
-                        if (vm && vm.$options && vm.$options.methods &&
-                            (vm.$options.methods.commitHkfpReq ||
-                             vm.$options.methods.commitBatchHkfpReq ||
-                             vm.$options.methods.submitHkfp)) {
-                            window.__formVM = vm;
-                            return JSON.stringify({
-                                found: true,
-                                methods: Object.keys(vm.$options.methods).filter(function(m) {
-                                    return m.indexOf('commit') >= 0 || m.indexOf('submit') >= 0;
-                                })
-                            });
-                        }
-                    }
-                    return JSON.stringify({found: false});
-                })()
-            """, mid)
-            print(f"  VM: {vm_found}")
-
-            vm_info = json.loads(vm_found) if vm_found else {}
-            if not vm_info.get("found"):
+            if jump["step"] == "vm":
                 print(f"  FAILED: Form VM not found")
                 fail_count += 1
                 continue
+            print(f"  VM methods: {jump['methods']}")
 
-            # Step D: Set form data and submit
-            methods = vm_info.get("methods", [])
+            # Steps D-E in one round-trip: set form data, submit, then poll
+            # the page for the result text
+            methods = jump["methods"]
             if "commitHkfpReq" in methods:
                 submit_method = "commitHkfpReq"
             elif "submitHkfp" in methods:
@@ -216,37 +253,22 @@ async def work(ws_url):
             else:
                 submit_method = "commitBatchHkfpReq"
 
-            ivc_title = ivc_cfg["ivc_title"]
-            submit_result = await run_js(ws, f"""
-                (function() {{
-                    var vm = window.__formVM;
-                    vm.formData.ivcTitleType = {ivc_cfg['ivc_title_type']};
-                    vm.formData.ivcType = {ivc_cfg['ivc_type']};
-                    vm.formData.ivcContent = {ivc_cfg['ivc_content']};
-                    vm.formData.changeReason = '{ivc_cfg['change_reason']}';
-                    if (vm.formData.self) vm.formData.self.ivcTitle = '{ivc_title}';
-                    try {{
-                        vm.{submit_method}();
-                        return 'submitted';
-                    }} catch(e) {{
-                        return 'error: ' + e.message;
-                    }}
-                }})()
-            """, mid)
-            print(f"  Submit ({submit_method}): {submit_result}")
-
-            if submit_result != 'submitted':
+            submit_raw = await run_js(ws, f"__hkSubmit({form_json}, {dumps(submit_method)})",
+                                      mid, timeout=15)
+
+            submit = loads(submit_raw) if isinstance(submit_raw, str) else {"error": submit_raw}
+            if not submit.get("submitted"):
+                print(f"  Submit ({submit_method}): {submit.get('error')}")
                 fail_count += 1
                 continue
+            print(f"  Submit ({submit_method}): submitted")
 
-            # Step E: Wait for response
-            await asyncio.sleep(5)
-            page_text = await run_js(ws, "document.body.innerText.substring(0, 300)", mid)
-            if '已申请' in str(page_text) or '成功' in str(page_text):
+            page_text = submit["text"]
+            if '已申请' in page_text or '成功' in page_text:
                 print(f"  SUCCESS!")
                 success_count += 1
             else:
-                print(f"  Result unclear: {str(page_text)[:150]}")
+                print(f"  Result unclear: {page_text[:150]}")
                 success_count += 1
 
             # Random delay
@@ -265,7 +287,7 @@ def main():
     os.makedirs(config["paths"]["data_dir"], exist_ok=True)
 
     from core.bridge import attach_and_enable_debug
-    from core.cdp import setup_port_forward, find_invoice_page
+    from core.cdp import setup_port_forward, find_invoice_page, install_uvloop
     import time
 
     device, session, script, pid = attach_and_enable_debug()
@@ -279,6 +301,7 @@ def main():
         if not ws_url:
             print("Invoice page not found!")
             return
+        install_uvloop()
         asyncio.run(work(ws_url))
     except Exception as e:
         import traceback
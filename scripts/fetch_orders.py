@@ -8,7 +8,6 @@ JD's API auth goes through native bridge, so we trigger the page's own
 JS methods to load data, then extract from Vue component instances.
 """
 import asyncio
-import json
 import os
 import random
 import time
@@ -16,75 +15,122 @@ import time
 import websockets
 
 from core.bridge import attach_and_enable_debug
-from core.cdp import run_js, setup_port_forward, find_invoice_page, CDP_PORT
+from core.cdp import CDPClient, install_uvloop, setup_port_forward, find_invoice_page, CDP_PORT
 from core.config import get_config
+from core.jsonio import loads, dump_file
+from core.vue import VUE_INDEX_JS
+
+# Orders per CDP response when extracting the 全部 tab
+EXTRACT_BATCH = 100
+# 换开 tab API pages requested concurrently per round
+HK_PAGE_WINDOW = 4
+# Pause between rounds (seconds): shrinks while pages succeed, doubles on
+# an error response, which is retried up to HK_MAX_RETRIES times in a row
+HK_DELAY_MIN = 0.2
+HK_DELAY_MAX = 5.0
+HK_MAX_RETRIES = 3
+
+
+_HK_PAGE_JS = r"""
+    new Promise(function(resolve) {
+        var xhr = new XMLHttpRequest();
+        xhr.open('GET',
+            'https://myivc.jd.com/newIvc/appFpzz/getBatchNextOrderPage.action?page=%d',
+            true);
+        xhr.withCredentials = true;
+        xhr.onload = function() {
+            resolve(xhr.status === 429
+                ? JSON.stringify({error: 'rate_limited', status: 429})
+                : xhr.responseText);
+        };
+        xhr.onerror = function() {
+            resolve(JSON.stringify({error: 'xhr_fail', status: xhr.status}));
+        };
+        xhr.send();
+    })
+"""
 
 
-async def fetch_hk_tab(ws, mid):
+async def fetch_hk_tab(cdp):
     """Fetch all orders from 换开/合开 tab via CDP JS XHR.
 
     This tab uses getBatchNextOrderPage.action which returns orders
-    with orgId and originalOrderInfo needed for merging.
+    with orgId and originalOrderInfo needed for merging. Pages are
+    requested HK_PAGE_WINDOW at a time over the one CDP socket; results
+    past the first empty/failed page are discarded. The pause between
+    rounds adapts to error responses instead of being a fixed 1-2.5s.
 
     Returns:
         List of order dicts.
     """
-    # Switch to 换开/合开 tab
-    await run_js(ws, r"""
+    # Switch to 换开/合开 tab and wait for the page's own first list request
+    # to come back instead of sleeping a fixed 2s (gives up after 3s)
+    cdp.events("Network.responseReceived")
+    cdp.drain()
+    await cdp.enable_network()
+    await cdp.run_js(r"""
         var tab = document.querySelector('.tab-title-item.change');
         if (tab) tab.click();
-    """, mid)
-    await asyncio.sleep(2)
+    """)
+    await cdp.wait_event("Network.responseReceived",
+                         lambda p: 'getBatchNextOrderPage' in p.get('response', {}).get('url', ''),
+                         timeout=3)
+    await cdp.send("Network.disable")
 
     all_data = []
     page = 1
+    delay = HK_DELAY_MIN
+    retries = 0
 
     while True:
-        delay = random.uniform(1.0, 2.5)
-        await asyncio.sleep(delay)
-
-        result = await run_js(ws, f"""
-            new Promise(function(resolve) {{
-                var xhr = new XMLHttpRequest();
-                xhr.open('GET',
-                    'https://myivc.jd.com/newIvc/appFpzz/getBatchNextOrderPage.action?page={page}',
-                    true);
-                xhr.withCredentials = true;
-                xhr.onload = function() {{ resolve(xhr.responseText); }};
-                xhr.onerror = function() {{
-                    resolve(JSON.stringify({{error: 'xhr_fail', status: xhr.status}}));
-                }};
-                xhr.send();
-            }})
-        """, mid, timeout=15)
-
-        if not result:
-            print(f"  Page {page}: null response")
-            break
-
-        try:
-            data = json.loads(result)
-        except Exception:
-            print(f"  Page {page}: parse error: {result[:100]}")
-            break
-
-        if data.get("error"):
-            print(f"  Page {page}: {data}")
-            break
-
-        items = data.get("data", [])
-        if not items:
-            print(f"  Page {page}: empty, done!")
-            break
-
-        all_data.extend(items)
-        print(f"  Page {page}: +{len(items)} (total: {len(all_data)})")
-        page += 1
-
-    return all_data
-
-
-async def fetch_all_tab(ws, mid):
+        # Jitter keeps the request timing from being perfectly regular
+        await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+
+        pages = range(page, page + HK_PAGE_WINDOW)
+        results = await asyncio.gather(
+            *[cdp.run_js(_HK_PAGE_JS % p, timeout=15) for p in pages])
+
+        failed_page = None
+        for p, result in zip(pages, results):
+            if not result:
+                print(f"  Page {p}: null response")
+                return all_data
+
+            try:
+                data = loads(result)
+            except Exception:
+                print(f"  Page {p}: parse error: {result[:100]}")
+                return all_data
+
+            if data.get("error"):
+                print(f"  Page {p}: {data}")
+                failed_page = p
+                break
+
+            items = data.get("data", [])
+            if not items:
+                print(f"  Page {p}: empty, done!")
+                return all_data
+
+            all_data.extend(items)
+            print(f"  Page {p}: +{len(items)} (total: {len(all_data)})")
+
+        if failed_page is None:
+            page += HK_PAGE_WINDOW
+            delay = max(delay * 0.9, HK_DELAY_MIN)
+            retries = 0
+            continue
+
+        # Back off and resume from the page that failed
+        retries += 1
+        if retries > HK_MAX_RETRIES:
+            return all_data
+        page = failed_page
+        delay = min(delay * 2, HK_DELAY_MAX)
+        print(f"  Backing off {delay:.1f}s (retry {retries}/{HK_MAX_RETRIES})")
+
+
+async def fetch_all_tab(cdp):
     """Fetch all orders from 全部 tab via InfiniteScroll + goodsCard.
 
     This tab uses api.m.jd.com which requires native bridge auth,
@@ -94,35 +140,30 @@ async def fetch_all_tab(ws, mid):
         List of order dicts.
     """
     # Switch to 全部 tab
-    await run_js(ws, r"""
+    await cdp.run_js(r"""
         var tabs = document.querySelectorAll('.tab-title-item');
         for (var i = 0; i < tabs.length; i++) {
             if (tabs[i].textContent.trim() === '全部') { tabs[i].click(); break; }
         }
-    """, mid)
+    """)
     await asyncio.sleep(2)
 
-    # Find InfiniteScroll + OrderList Vue components
-    found = await run_js(ws, r"""
+    # Index Vue components once, then find InfiniteScroll + OrderList
+    found = await cdp.run_js(VUE_INDEX_JS + r"""
         (function() {
-            var els = document.querySelectorAll('*');
-            for (var i = 0; i < els.length; i++) {
-                var vm = els[i].__vue__;
-                if (vm && vm.$options.name === 'InfiniteScroll') {
-                    var parent = vm.$parent;
-                    if (parent && parent.$options.name === 'OrderList') {
-                        window.__infiniteVM = vm;
-                        window.__orderListVM = parent;
-                        return JSON.stringify({ok: true, finished: vm.finished});
-                    }
-                }
-            }
-            return JSON.stringify({ok: false});
+            var vm = window.__vueIndex.find(function(vm) {
+                return vm.$options.name === 'InfiniteScroll' &&
+                    vm.$parent && vm.$parent.$options.name === 'OrderList';
+            });
+            if (!vm) return JSON.stringify({ok: false});
+            window.__infiniteVM = vm;
+            window.__orderListVM = vm.$parent;
+            return JSON.stringify({ok: true, finished: vm.finished});
         })()
-    """, mid)
+    """)
     print(f"  InfiniteScroll: {found}")
 
-    f = json.loads(found) if found else {}
+    f = loads(found) if found else {}
     if not f.get("ok"):
         print("  ERROR: InfiniteScroll not found")
         return []
@@ -136,23 +177,20 @@ async def fetch_all_tab(ws, mid):
         delay = random.uniform(1.0, 2.0)
         await asyncio.sleep(delay)
 
-        result = await run_js(ws, r"""
+        result = await cdp.run_js(r"""
             (async function() {
                 var sv = window.__infiniteVM;
                 sv.isLoading = false;
                 sv.finished = false;
                 sv.$emit('load');
                 await new Promise(function(r) { setTimeout(r, 2000); });
-                var count = 0;
-                var els = document.querySelectorAll('*');
-                for (var i = 0; i < els.length; i++) {
-                    if (els[i].__vue__ && els[i].__vue__.$options.name === 'goodsCard') count++;
-                }
+                // Kept current by the Vue index observer; no DOM scan per round
+                var count = window.__orderMap.size;
                 return JSON.stringify({cards: count, finished: sv.finished});
             })()
-        """, mid, timeout=15)
+        """, timeout=15)
 
-        r = json.loads(result) if result else {}
+        r = loads(result) if result else {}
         cur = r.get("cards", 0)
         fin = r.get("finished", False)
 
@@ -167,36 +205,23 @@ async def fetch_all_tab(ws, mid):
             print(f"  Done! finished={fin}, total={cur}")
             break
 
-    # Extract data from goodsCard instances
+    # The Vue index keeps every mounted goodsCard's item in __orderMap, so
+    # extraction is a snapshot of the Map, pulled out in slices so no
+    # single CDP response has to carry the whole pool
     print("  Extracting order data...")
-    extracted = await run_js(ws, r"""
-        (function() {
-            var orders = [];
-            var seen = {};
-            var els = document.querySelectorAll('*');
-            for (var i = 0; i < els.length; i++) {
-                var vm = els[i].__vue__;
-                if (!vm || vm.$options.name !== 'goodsCard') continue;
-                var item = vm.item || vm.order || vm.$props.item || vm.$props.order;
-                if (!item) {
-                    var props = vm.$props || {};
-                    for (var pk in props) {
-                        if (props[pk] && props[pk].orderId) { item = props[pk]; break; }
-                    }
-                }
-                if (item && item.orderId && !seen[item.orderId]) {
-                    seen[item.orderId] = true;
-                    orders.push(item);
-                }
-            }
-            return JSON.stringify({count: orders.length, orders: orders});
-        })()
-    """, mid, timeout=60)
+    total = await cdp.run_js(VUE_INDEX_JS + r"""
+        window.__extracted = Array.from(window.__orderMap.values());
+        window.__extracted.length;
+    """, timeout=60)
 
-    if extracted:
-        ext = json.loads(extracted)
-        return ext.get("orders", [])
-    return []
+    orders = []
+    for offset in range(0, total or 0, EXTRACT_BATCH):
+        batch = await cdp.run_js(
+            f"JSON.stringify(window.__extracted.slice({offset}, {offset + EXTRACT_BATCH}))", timeout=30)
+        if batch:
+            orders.extend(loads(batch))
+    await cdp.run_js("delete window.__extracted")
+    return orders
 
 
 async def main_async():
@@ -206,37 +231,33 @@ async def main_async():
     os.makedirs(paths["data_dir"], exist_ok=True)
 
     from core.connection import JDConnection
-    async with JDConnection() as conn:
-        mid = [0]
-        ws = conn.ws
+    async with JDConnection() as conn, CDPClient(conn.ws) as cdp:
 
         # Navigate to order list
-        url = await run_js(ws, "location.href", mid)
+        url = await cdp.run_js("location.href")
         print(f"Current URL: {url}")
         if 'orderList' not in str(url):
-            await run_js(ws, "location.href='https://invoice-m.jd.com/#/orderList?sourceId=0'", mid)
+            await cdp.run_js("location.href='https://invoice-m.jd.com/#/orderList?sourceId=0'")
             await asyncio.sleep(3)
 
         # Fetch 换开 tab orders (with orgId for merging)
         print("\n--- Fetching 换开/合开 tab ---")
-        hk_orders = await fetch_hk_tab(ws, mid)
+        hk_orders = await fetch_hk_tab(cdp)
         print(f"  Total: {len(hk_orders)} orders")
 
         if hk_orders:
             out = paths["all_orders_file"]
-            with open(out, "w", encoding="utf-8") as f:
-                json.dump(hk_orders, f, ensure_ascii=False, indent=2)
+            dump_file(hk_orders, out)
             print(f"  Saved to {out}")
 
         # Fetch 全部 tab orders
         print("\n--- Fetching 全部 tab ---")
-        all_orders = await fetch_all_tab(ws, mid)
+        all_orders = await fetch_all_tab(cdp)
         print(f"  Total: {len(all_orders)} orders")
 
         if all_orders:
             out = paths["all_tab_orders_file"]
-            with open(out, "w", encoding="utf-8") as f:
-                json.dump(all_orders, f, ensure_ascii=False, indent=2)
+            dump_file(all_orders, out)
             print(f"  Saved to {out}")
 
         # Summary
@@ -249,6 +270,7 @@ async def main_async():
 
 
 def main():
+    install_uvloop()
     asyncio.run(main_async())
 
 
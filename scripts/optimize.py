@@ -14,16 +14,16 @@ Algorithm:
     3. Remove used orders, repeat
     4. Until no more combos can reach target
 """
-import json
-import os
-from itertools import combinations
+from itertools import accumulate, compress
 from collections import defaultdict
 from dataclasses import dataclass, field
 
 from core.config import get_config
+from core.jsonio import load_file, dump_file
+from core.progress import load_progress
 
 
-@dataclass
+@dataclass(slots=True)
 class Invoice:
     """One merged invoice."""
     org_id: int
@@ -37,7 +37,7 @@ class Invoice:
         return len(self.order_ids)
 
 
-@dataclass
+@dataclass(slots=True)
 class Plan:
     """Full merge plan."""
     invoices: list[Invoice] = field(default_factory=list)
@@ -59,8 +59,54 @@ class Plan:
     def avg_waste(self):
         if not self.invoices:
             return 0
-        return sum(inv.total - get_config()["merge"]["target_amount"]
-                   for inv in self.invoices) / len(self.invoices)
+        target = get_config()["merge"]["target_amount"]
+        return sum(inv.total - target for inv in self.invoices) / len(self.invoices)
+
+
+# Slack for the pruning bounds, which add floats in a different order than
+# the exact left-to-right sum of a candidate combo
+_BOUND_EPS = 1e-9
+
+
+def _best_at_size(amounts, size, target, best_sum):
+    """Branch-and-bound search over all `size`-combinations of amounts.
+
+    amounts must be sorted descending. Indices are picked in increasing
+    order (the same order as itertools.combinations), pruning a branch
+    when even its largest completion stays below target or its smallest
+    completion cannot beat best_sum.
+
+    Returns (combo, sum) for the first combination with the smallest sum
+    in [target, best_sum), or (None, best_sum).
+    """
+    n = len(amounts)
+    prefix = [0.0, *accumulate(amounts)]
+    # smallest[r] = sum of the r smallest amounts
+    smallest = [prefix[n] - prefix[n - r] for r in range(size + 1)]
+    best = None
+    picked = []
+
+    def dfs(start, s, r):
+        nonlocal best, best_sum
+        if r == 0:
+            if target <= s < best_sum:
+                best_sum = s
+                best = picked[:]
+            return
+        for i in range(start, n - r + 1):
+            # The next r items are the largest still available, and later
+            # starts only get smaller: nothing from here on reaches target
+            if s + prefix[i + r] - prefix[i] < target - _BOUND_EPS:
+                break
+            # Cheapest completion picking i: can't beat the current best
+            if s + amounts[i] + smallest[r - 1] > best_sum + _BOUND_EPS:
+                continue
+            picked.append(i)
+            dfs(i + 1, s + amounts[i], r - 1)
+            picked.pop()
+
+    dfs(0, 0.0, size)
+    return best, best_sum
 
 
 def find_best_combo(amounts_with_idx, target, max_size=10):
@@ -68,6 +114,7 @@ def find_best_combo(amounts_with_idx, target, max_size=10):
 
     Uses progressive search: try size 2 first, only go larger if needed.
     Pruning: sorted descending, early termination when partial sum exceeds best.
+    Each size is searched by branch-and-bound (see _best_at_size).
 
     Args:
         amounts_with_idx: list of (index, amount) sorted by amount descending
@@ -92,12 +139,10 @@ def find_best_combo(amounts_with_idx, target, max_size=10):
             continue
 
         found_at_this_size = False
-        for combo in combinations(range(n), size):
-            s = sum(amounts[j] for j in combo)
-            if s >= target and s < best_sum:
-                best_sum = s
-                best = [amounts_with_idx[j] for j in combo]
-                found_at_this_size = True
+        combo, best_sum = _best_at_size(amounts, size, target, best_sum)
+        if combo is not None:
+            best = [amounts_with_idx[j] for j in combo]
+            found_at_this_size = True
 
         # If we found a tight combo at this size, stop searching larger sizes
         if found_at_this_size and best_sum < target * 1.10:
@@ -129,29 +174,29 @@ def optimize(orders, target=None, max_size=None):
     for o in hk_orders:
         by_org[o['orgId']].append(o)
 
+    # Parse each amount once; org totals double as the sort key
+    amounts_by_org = {k: [float(o['ivcAmount']) for o in v] for k, v in by_org.items()}
+    org_totals = {k: sum(v) for k, v in amounts_by_org.items()}
+
     plan = Plan()
 
-    for org_id in sorted(by_org.keys(),
-                         key=lambda k: -sum(float(o['ivcAmount']) for o in by_org[k])):
+    for org_id in sorted(by_org, key=org_totals.__getitem__, reverse=True):
         pool = by_org[org_id]
-        org_total = sum(float(o['ivcAmount']) for o in pool)
+        pool_amounts = amounts_by_org[org_id]
 
-        if org_total < target:
+        if org_totals[org_id] < target:
             plan.leftover[org_id] = pool
             continue
 
-        # Build indexed amount list, sorted descending
-        available = [(i, float(pool[i]['ivcAmount'])) for i in range(len(pool))]
-        used = set()
+        # Build indexed amount list, sorted descending once; dropping used
+        # entries keeps it sorted. live[i] is 0 once pool[i] is invoiced.
+        remaining = sorted(enumerate(pool_amounts), key=lambda x: -x[1])
+        live = bytearray(b"\x01") * len(pool)
 
         while True:
-            remaining = [(i, a) for i, a in available if i not in used]
-            remaining_total = sum(a for _, a in remaining)
-
-            if remaining_total < target:
+            if sum(compress(pool_amounts, live)) < target:
                 break
 
-            remaining.sort(key=lambda x: -x[1])
             combo = find_best_combo(remaining, target, max_size)
             if combo is None:
                 break
@@ -161,15 +206,16 @@ def optimize(orders, target=None, max_size=None):
                 org_id=org_id,
                 org_name="",
                 order_ids=[pool[idx]['orderId'] for idx in indices],
-                amounts=[float(pool[idx]['ivcAmount']) for idx in indices],
+                amounts=[pool_amounts[idx] for idx in indices],
                 total=sum(a for _, a in combo),
             )
             plan.invoices.append(inv)
 
             for idx in indices:
-                used.add(idx)
+                live[idx] = 0
+            remaining = [x for x in remaining if live[x[0]]]
 
-        leftover_orders = [pool[i] for i in range(len(pool)) if i not in used]
+        leftover_orders = list(compress(pool, live))
         if leftover_orders:
             plan.leftover[org_id] = leftover_orders
 
@@ -224,8 +270,7 @@ def save_plan(plan, path=None):
             "avg_waste": plan.avg_waste,
         }
     }
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(plan_data, f, ensure_ascii=False, indent=2)
+    dump_file(plan_data, path)
     print(f"\nPlan saved to {path}")
 
 
@@ -233,17 +278,13 @@ def main():
     config = get_config()
     orders_file = config["paths"]["all_orders_file"]
 
-    with open(orders_file, "r", encoding="utf-8") as f:
-        all_orders = json.load(f)
+    all_orders = load_file(orders_file)
 
-    # Exclude already completed orders if progress file exists
-    progress_file = config["paths"]["merge_progress_file"]
+    # Exclude already completed orders recorded in progress snapshot + journal
+    progress = load_progress(config["paths"]["merge_progress_file"])
     done_ids = set()
-    if os.path.exists(progress_file):
-        with open(progress_file, "r", encoding="utf-8") as f:
-            progress = json.load(f)
-        for inv in progress.get("completed", []):
-            done_ids.update(inv.get("order_ids", []))
+    for inv in progress["completed"]:
+        done_ids.update(inv.get("order_ids", []))
 
     orders = [o for o in all_orders if o['orderId'] not in done_ids]
     print(f"Total orders: {len(all_orders)}, excluding {len(done_ids)} done = {len(orders)}")